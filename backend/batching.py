@@ -0,0 +1,101 @@
+import time
+import threading
+import typing as t
+from concurrent.futures import Future
+
+import metrics
+
+BATCH_SIZE = metrics.histogram(
+    "batch_size",
+    "Number of distinct requests served by one batched backend call.",
+    ("batcher",),
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+COALESCED = metrics.counter(
+    "coalesced_requests_total",
+    "Requests that joined an identical in-flight request instead of issuing their own.",
+    ("batcher",),
+)
+
+
+class MicroBatcher:
+    """
+    Collects requests that arrive within `window_ms` of each other and serves
+    them with one call to `batch_fn(items) -> results` (same order, same length).
+
+    Requests with the same key while one is still in flight share a single
+    Future, so identical concurrent questions only hit the backend once.
+
+    Stage timings recorded by `batch_fn` run on the worker thread; they are
+    copied into the trace of every request the batch served.
+    """
+
+    def __init__(self, name: str, batch_fn: t.Callable[[list], list],
+                 window_ms: float = 5.0, max_batch: int = 32):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending: t.List[tuple] = []        # (key, item, future)
+        self._inflight: t.Dict[t.Hashable, t.Tuple[Future, list]] = {}   # key -> (future, caller traces)
+        self._cond = threading.Condition()
+        self._worker = None
+
+    def submit(self, key: t.Hashable, item) -> Future:
+        with self._cond:
+            spans = metrics.current_spans()
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                COALESCED.inc(1, self.name)
+                inflight[1].append(spans)
+                return inflight[0]
+            fut = Future()
+            self._inflight[key] = (fut, [spans])
+            self._pending.append((key, item, fut))
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+        return fut
+
+    def __call__(self, key: t.Hashable, item):
+        return self.submit(key, item).result()
+
+    def _next_batch(self) -> t.List[tuple]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Give concurrent callers a short window to join this batch
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            BATCH_SIZE.observe(len(batch), self.name)
+            try:
+                with metrics.capture_spans() as spans:
+                    results = self.batch_fn([item for _, item, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: expected {len(batch)} results, got {len(results)}")
+            except Exception as e:
+                results, error = None, e
+            else:
+                error = None
+            with self._cond:
+                traces = [tr for key, _, _ in batch for tr in self._inflight.pop(key)[1] if tr is not None]
+            # One caller may have several items in the batch; record the spans once per trace
+            for tr in {id(tr): tr for tr in traces}.values():
+                tr.extend(spans)
+            for i, (_, _, fut) in enumerate(batch):
+                if error is not None:
+                    fut.set_exception(error)
+                else:
+                    fut.set_result(results[i])
@@ -1,5 +1,6 @@
 import os
 import json
+import heapq
 import time
 import uuid
 import typing as t
@@ -12,6 +13,9 @@ from bs4 import BeautifulSoup
 import chromadb
 from chromadb.utils import embedding_functions
 
+from metrics import timed, count
+import chunk_store
+
 
 # ----------------------------
 # Config
@@ -19,8 +23,7 @@ from chromadb.utils import embedding_functions
 HISTORY_DB_PATH = "./browser_history_db"     # where your earlier script saved the browser_history collection
 HISTORY_COLLECTION = "browser_history"
 
-CHUNKS_DB_PATH = "./page_chunks_db"          # new persistent DB for page chunks
-CHUNKS_COLLECTION = "page_chunks"
+CHUNKS_DB_PATH = chunk_store.CHUNKS_DB_PATH  # persistent DB for page chunks, one collection per month
 
 SEEN_URLS_FILE = "seen_urls.json"            # remembers which URLs we already processed
 BLOCK_DOMAINS_FILE = "block_domains.json"    # domains to ignore
@@ -37,7 +40,7 @@ USER_AGENT = (
 )
 
 OLLAMA_EMBED_URL = "http://localhost:11434/api/embeddings"
-OLLAMA_EMBED_MODEL = "nomic-embed-text"
+OLLAMA_EMBED_MODEL = chunk_store.EMBED_MODEL
 
 
 # ----------------------------
@@ -105,6 +108,7 @@ def domain_blocked(url: str, blocklist: t.List[str]) -> bool:
 # ----------------------------
 # Fetch latest URLs from history
 # ----------------------------
+@timed("history_read")
 def get_latest_history_urls(limit: int = 50) -> t.List[dict]:
     client = chromadb.PersistentClient(path=HISTORY_DB_PATH)
     coll = client.get_or_create_collection(HISTORY_COLLECTION)
@@ -121,10 +125,11 @@ def get_latest_history_urls(limit: int = 50) -> t.List[dict]:
         except Exception:
             return datetime.min
 
-    # Sort by time desc, then take limit
-    sorted_metas = sorted(metadatas, key=parse_time, reverse=True)
+    # Newest `limit` by time; a bounded heap avoids sorting the whole history
     if limit:
-        sorted_metas = sorted_metas[:limit]
+        sorted_metas = heapq.nlargest(limit, metadatas, key=parse_time)
+    else:
+        sorted_metas = sorted(metadatas, key=parse_time, reverse=True)
 
     return sorted_metas
 
@@ -132,6 +137,7 @@ def get_latest_history_urls(limit: int = 50) -> t.List[dict]:
 # ----------------------------
 # HTTP fetch + text extraction
 # ----------------------------
+@timed("fetch")
 def fetch_html(url: str) -> t.Optional[str]:
     try:
         resp = requests.get(
@@ -150,6 +156,7 @@ def fetch_html(url: str) -> t.Optional[str]:
         return None
 
 
+@timed("parse")
 def html_to_text(html: str) -> str:
     soup = BeautifulSoup(html, "html.parser")
 
@@ -166,6 +173,7 @@ def html_to_text(html: str) -> str:
 # ----------------------------
 # Chunking
 # ----------------------------
+@timed("chunk")
 def chunk_text(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> t.List[str]:
     chunks = []
     start = 0
@@ -189,6 +197,7 @@ class OllamaEmbeddingFunction(embedding_functions.EmbeddingFunction):
         self.model = model
         self.url = url
 
+    @timed("embed")
     def __call__(self, input: t.List[str]) -> t.List[t.List[float]]:
         # Batch over HTTP to the local Ollama embeddings API
         # API: POST /api/embeddings { "model": "...", "prompt": "..." }
@@ -215,6 +224,7 @@ class OllamaEmbeddingFunction(embedding_functions.EmbeddingFunction):
                 except Exception:
                     # if still failing, append zero vector placeholder to keep alignment (not ideal)
                     embeddings.append([])
+        count("embed", len(input))
         return embeddings
 
 
@@ -248,14 +258,10 @@ def main():
         print("No new URLs to process (after filtering seen + blocklist).")
         return
 
-    # Prepare chunks collection with Ollama embedding function
+    # Chunks go into the monthly segment of the page's visit time
     emb_fn = OllamaEmbeddingFunction()
     chunks_client = chromadb.PersistentClient(path=CHUNKS_DB_PATH)
-    chunks_coll = chunks_client.get_or_create_collection(
-        CHUNKS_COLLECTION,
-        embedding_function=emb_fn,
-        metadata={"source": "browser_history_pages"},
-    )
+    chunks_coll = None
 
     added_count = 0
     newly_seen = set(seen)
@@ -285,6 +291,7 @@ def main():
         metadatas = []
 
         base_id = uuid.uuid4().hex[:12]
+        time_meta = chunk_store.time_metadata(ts_iso)
         for idx, chunk in enumerate(chunks):
             ids.append(f"{base_id}_{idx}")
             documents.append(chunk)
@@ -293,12 +300,17 @@ def main():
                 "title": title,
                 "chunk_index": idx,
                 "time": ts_iso,
+                **time_meta,
             })
 
         # Add to Chroma with embeddings from Ollama
         try:
-            chunks_coll.add(ids=ids, documents=documents, metadatas=metadatas)
+            embeddings = emb_fn(documents)
+            chunks_coll = chunk_store.get_segment(chunks_client, chunk_store.segment_for(ts_iso), emb_fn)
+            with timed("vector_add"):
+                chunks_coll.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
             print(f"  Added {len(ids)} chunks.")
+            count("vector_add", len(ids))
             added_count += 1
         except Exception as e:
             print(f"  Failed to add chunks: {e}")
@@ -310,6 +322,8 @@ def main():
     print(f"\nDone. Pages processed: {added_count}. Seen URLs now: {len(newly_seen)}")
 
     # Show a quick sample of the latest stored chunks for sanity
+    if chunks_coll is None:
+        return
     stored = chunks_coll.get(limit=3, include=["metadatas"])
     if stored and stored.get("ids"):
         print("\nSample stored chunk metadata:")
@@ -0,0 +1,339 @@
+import os
+import time
+import threading
+import typing as t
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import timed, count
+
+# ----------------------------
+# Config
+# ----------------------------
+CHUNKS_DB_PATH = "./page_chunks_db"
+EMBED_MODEL = "nomic-embed-text"             # Ollama model every chunk vector is embedded with
+LEGACY_COLLECTION = "page_chunks"            # single pre-partitioning collection
+SEGMENT_PREFIX = "page_chunks_"              # page_chunks_2026_04, page_chunks_undated
+UNDATED_SEGMENT = f"{SEGMENT_PREFIX}undated"
+
+# Drop whole monthly segments older than this many months (0 = keep forever)
+RETENTION_MONTHS = int(os.getenv("BROWSER_RAG_RETENTION_MONTHS", "0"))
+MIGRATE_BATCH = 500
+# Without a since/until filter, optionally search only the newest N monthly
+# segments (0 = all). Opt-in: the frontend sends no filter, so a bound hides older pages.
+UNFILTERED_SEGMENTS = int(os.getenv("BROWSER_RAG_UNFILTERED_SEGMENTS", "0"))
+SEGMENT_QUERY_WORKERS = 8    # segments searched in parallel
+COMPACT_BATCH = 1000
+
+
+# ----------------------------
+# Segment naming
+# ----------------------------
+def _parse_time(ts_iso: t.Optional[str]) -> t.Optional[datetime]:
+    if not ts_iso:
+        return None
+    try:
+        return datetime.fromisoformat(ts_iso)
+    except (TypeError, ValueError):
+        return None
+
+
+def segment_for(ts_iso: t.Optional[str]) -> str:
+    """Monthly segment holding chunks for a page visited at `ts_iso`."""
+    ts = _parse_time(ts_iso)
+    if ts is None:
+        return UNDATED_SEGMENT
+    return f"{SEGMENT_PREFIX}{ts.year:04d}_{ts.month:02d}"
+
+
+def segment_month(name: str) -> t.Optional[t.Tuple[int, int]]:
+    """(year, month) of a segment name, or None for the undated segment."""
+    try:
+        year, month = name[len(SEGMENT_PREFIX):].split("_")
+        return int(year), int(month)
+    except ValueError:
+        return None
+
+
+def to_local(ts: t.Optional[datetime]) -> t.Optional[datetime]:
+    # Visit times are stored as naive local time; compare filters the same way
+    if ts is not None and ts.tzinfo is not None:
+        return ts.astimezone().replace(tzinfo=None)
+    return ts
+
+
+def _month_index(year: int, month: int) -> int:
+    return year * 12 + (month - 1)
+
+
+def segment_overlaps(name: str, since: t.Optional[datetime], until: t.Optional[datetime]) -> bool:
+    """Whether any chunk in segment `name` could fall inside [since, until]."""
+    if since is None and until is None:
+        return True
+    ym = segment_month(name)
+    if ym is None:
+        return False    # undated chunks can't satisfy a time filter
+    idx = _month_index(*ym)
+    if since is not None and idx < _month_index(since.year, since.month):
+        return False
+    if until is not None and idx > _month_index(until.year, until.month):
+        return False
+    return True
+
+
+def time_metadata(ts_iso: t.Optional[str]) -> dict:
+    """
+    Extra metadata for a newly ingested chunk: numeric `ts` (visit time) so
+    segments can be filtered exactly, and `ingested_at` so compaction can tell
+    which copy of a re-ingested page is newest.
+    """
+    meta = {"ingested_at": time.time()}
+    ts = _parse_time(ts_iso)
+    if ts is not None:
+        meta["ts"] = ts.timestamp()
+    return meta
+
+
+# ----------------------------
+# Segment access
+# ----------------------------
+def list_segments(client) -> t.List[str]:
+    # chromadb >= 0.6 returns names, older versions return Collection objects
+    names = [getattr(c, "name", c) for c in client.list_collections()]
+    return sorted(n for n in names if n.startswith(SEGMENT_PREFIX))
+
+
+def get_segment(client, name: str, embedding_function=None):
+    return client.get_or_create_collection(
+        name,
+        embedding_function=embedding_function,
+        metadata={"source": "browser_history_pages"},
+    )
+
+
+def open_segments(client, embedding_function=None) -> t.Dict[str, t.Any]:
+    """All searchable collections, including a not-yet-migrated legacy one."""
+    names = list_segments(client)
+    if LEGACY_COLLECTION in [getattr(c, "name", c) for c in client.list_collections()]:
+        names.append(LEGACY_COLLECTION)
+    return {name: get_segment(client, name, embedding_function) for name in names}
+
+
+_query_pool = None
+_query_pool_lock = threading.Lock()
+
+
+def _get_query_pool() -> ThreadPoolExecutor:
+    global _query_pool
+    if _query_pool is None:
+        with _query_pool_lock:
+            if _query_pool is None:
+                _query_pool = ThreadPoolExecutor(SEGMENT_QUERY_WORKERS, thread_name_prefix="segment-query")
+    return _query_pool
+
+
+def select_segments(names: t.Iterable[str], since: t.Optional[datetime] = None,
+                    until: t.Optional[datetime] = None) -> t.List[str]:
+    """
+    Segments a search should touch. With a time filter, every overlapping
+    month. Without one, every segment, unless UNFILTERED_SEGMENTS is set:
+    then only the newest N months (plus the undated and not-yet-migrated
+    legacy collections), which caps latency at the cost of older pages.
+    """
+    names = [n for n in names if segment_overlaps(n, since, until)]
+    if since is not None or until is not None or UNFILTERED_SEGMENTS <= 0:
+        return names
+    dated = sorted((n for n in names if segment_month(n) is not None), key=segment_month, reverse=True)
+    undated = [n for n in names if segment_month(n) is None]
+    return dated[:UNFILTERED_SEGMENTS] + undated
+
+
+def query_segments(segments: t.Dict[str, t.Any], query_embeddings: list, n_results: int,
+                   since: t.Optional[datetime] = None,
+                   until: t.Optional[datetime] = None) -> t.List[t.List[str]]:
+    """
+    Fan a multi-query search out to the selected segments in parallel and
+    merge the per-segment hits by distance. Returns documents per query.
+    """
+    since, until = to_local(since), to_local(until)
+    where = {}
+    if since is not None:
+        where["ts"] = {"$gte": since.timestamp()}
+    if until is not None:
+        bound = {"$lte": until.timestamp()}
+        where = {"$and": [where, {"ts": bound}]} if where else {"ts": bound}
+
+    def search(name):
+        try:
+            return segments[name].query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where or None,
+                include=["documents", "distances"],
+            )
+        except Exception as e:
+            # e.g. the segment was dropped by retention since it was opened
+            print(f"[RAG] Skipping segment {name}: {e}")
+            return None
+
+    hits: t.List[list] = [[] for _ in query_embeddings]
+    for res in _get_query_pool().map(search, select_segments(segments, since, until)):
+        if res is None:
+            continue
+        for qi, (docs, dists) in enumerate(zip(res.get("documents") or [], res.get("distances") or [])):
+            hits[qi].extend(zip(dists, docs))
+
+    return [[doc for _, doc in sorted(h, key=lambda x: x[0])[:n_results]] for h in hits]
+
+
+# ----------------------------
+# Retention
+# ----------------------------
+def apply_retention(client, months: int = RETENTION_MONTHS, now: t.Optional[datetime] = None) -> t.List[str]:
+    """Delete whole monthly segments older than `months`. Returns the dropped names."""
+    if months <= 0:
+        return []
+    now = now or datetime.now()
+    cutoff = _month_index(now.year, now.month) - months
+    dropped = []
+    for name in list_segments(client):
+        ym = segment_month(name)
+        if ym is not None and _month_index(*ym) < cutoff:
+            client.delete_collection(name)
+            dropped.append(name)
+    if dropped:
+        print(f"[retention] Dropped {len(dropped)} segments: {', '.join(dropped)}")
+    return dropped
+
+
+# ----------------------------
+# Migration + compaction
+# ----------------------------
+def migrate_legacy(client) -> int:
+    """
+    Move chunks from the old single `page_chunks` collection into monthly
+    segments, carrying their stored embeddings over (no re-embedding).
+    """
+    names = [getattr(c, "name", c) for c in client.list_collections()]
+    if LEGACY_COLLECTION not in names:
+        return 0
+    legacy = client.get_collection(LEGACY_COLLECTION)
+    moved = 0
+    while True:
+        batch = legacy.get(limit=MIGRATE_BATCH, include=["documents", "metadatas", "embeddings"])
+        ids = batch.get("ids") or []
+        if not ids:
+            break
+        by_segment: t.Dict[str, list] = {}
+        for row in zip(ids, batch["documents"], batch["metadatas"], batch["embeddings"]):
+            meta = dict(row[2] or {})
+            ts = _parse_time(meta.get("time"))
+            if ts is not None:
+                meta.setdefault("ts", ts.timestamp())
+            by_segment.setdefault(segment_for(meta.get("time")), []).append((row[0], row[1], meta, row[3]))
+        for name, rows in by_segment.items():
+            get_segment(client, name).upsert(
+                ids=[r[0] for r in rows],
+                documents=[r[1] for r in rows],
+                metadatas=[r[2] for r in rows],
+                embeddings=[list(r[3]) for r in rows],
+            )
+        legacy.delete(ids=ids)
+        moved += len(ids)
+    client.delete_collection(LEGACY_COLLECTION)
+    print(f"[compaction] Migrated {moved} legacy chunks into monthly segments")
+    return moved
+
+
+def _base_id(chunk_id: str) -> str:
+    return chunk_id.rsplit("_", 1)[0]
+
+
+def _ingest_rank(meta: dict) -> t.Optional[float]:
+    """
+    How recent a chunk's ingestion is. Chunks written before `ingested_at`
+    existed fall back to their visit time; None means there is no way to tell.
+    """
+    if meta.get("ingested_at") is not None:
+        return float(meta["ingested_at"])
+    if meta.get("ts") is not None:
+        return float(meta["ts"])
+    ts = _parse_time(meta.get("time"))
+    return ts.timestamp() if ts is not None else None
+
+
+def _iter_metadata(coll) -> t.Iterator[t.Tuple[str, dict]]:
+    """Page through a segment's ids + metadata without loading it all at once."""
+    offset = 0
+    while True:
+        batch = coll.get(limit=COMPACT_BATCH, offset=offset, include=["metadatas"])
+        ids = batch.get("ids") or []
+        if not ids:
+            return
+        for chunk_id, meta in zip(ids, batch.get("metadatas") or []):
+            yield chunk_id, meta or {}
+        offset += len(ids)
+
+
+@timed("compaction")
+def compact(client, is_blocked: t.Callable[[str], bool] = lambda url: False) -> int:
+    """
+    Purge chunks that no longer belong in the index:
+    - superseded: a URL re-ingested under a newer base id keeps only the newest copy
+    - orphaned: chunks without a URL, or whose domain is now blocklisted
+    Chunks whose ingestion time can't be determined are never purged as
+    superseded. Segments confirmed empty after the deletes are dropped.
+    Returns the number of chunks deleted.
+    """
+    segments = {name: client.get_collection(name) for name in list_segments(client)}
+
+    # Pass 1: url -> (rank, base_id) of the newest ingestion, across all segments.
+    # Memory grows with the number of distinct pages, not chunks.
+    newest: t.Dict[str, t.Tuple[float, str]] = {}
+    for coll in segments.values():
+        for chunk_id, meta in _iter_metadata(coll):
+            url = meta.get("url")
+            rank = _ingest_rank(meta)
+            if not url or rank is None:
+                continue
+            key = (rank, _base_id(chunk_id))
+            if url not in newest or key > newest[url]:
+                newest[url] = key
+
+    # Pass 2: collect stale ids per segment, delete once the scan is done so
+    # offsets stay stable while paging
+    deleted = 0
+    for name, coll in segments.items():
+        stale = []
+        for chunk_id, meta in _iter_metadata(coll):
+            url = meta.get("url")
+            if not url or is_blocked(url):
+                stale.append(chunk_id)
+            elif _ingest_rank(meta) is not None and _base_id(chunk_id) != newest[url][1]:
+                stale.append(chunk_id)
+        for i in range(0, len(stale), COMPACT_BATCH):
+            coll.delete(ids=stale[i:i + COMPACT_BATCH])
+        deleted += len(stale)
+        # Chunks may have been added since the scan; only drop what is really empty
+        if coll.count() == 0:
+            client.delete_collection(name)
+
+    count("compaction", deleted)
+    print(f"[compaction] Purged {deleted} orphaned/superseded chunks")
+    return deleted
+
+
+def run_maintenance(client, retention_months: int = RETENTION_MONTHS) -> None:
+    """Migration, retention and compaction in one pass (safe to run repeatedly)."""
+    from chunk_and_embedd import load_blocklist, domain_blocked
+
+    blocklist = load_blocklist()
+    migrate_legacy(client)
+    apply_retention(client, retention_months)
+    compact(client, lambda url: domain_blocked(url, blocklist))
+
+
+if __name__ == "__main__":
+    import chromadb
+
+    run_maintenance(chromadb.PersistentClient(path=CHUNKS_DB_PATH))
@@ -1,26 +1,172 @@
+import queue
 import sqlite3
-def init_db():
-    conn = sqlite3.connect("chat.db")
-    c = conn.cursor()
-    
+import threading
+from contextlib import contextmanager
+
+DB_PATH = "chat.db"
+POOL_SIZE = 8
+
+
+class ConnectionPool:
+    """Reuses SQLite connections across requests instead of reconnecting every time."""
+
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self) -> sqlite3.Connection:
+        # FastAPI runs sync endpoints in a threadpool, so a connection may be
+        # handed to a different thread than the one that created it.
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            # Release the connection on both the success and the error path
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def get_conn():
+    """Borrow a pooled connection: `with get_conn() as conn: ...`"""
+    return get_pool().connection()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+            _pool = None
+
+
+def _init_message_search(c):
+    """
+    FTS5 index over message content. It is an external-content table
+    (no second copy of the text) kept in sync with `messages` by triggers.
+    """
+    exists = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='messages_fts'"
+    ).fetchone()
+
     c.execute("""
-        CREATE TABLE IF NOT EXISTS conversations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content,
+            content='messages',
+            content_rowid='id',
+            tokenize='porter unicode61'
         )
     """)
-    
     c.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            conversation_id INTEGER NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (conversation_id) REFERENCES conversations(id)
-        )
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
     """)
-    
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+
+    if not exists:
+        # Index messages written before search existed
+        c.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+def init_db():
+    with get_conn() as conn:
+        c = conn.cursor()
+
+        # WAL lets readers (conversation list, history) proceed while a chat writes
+        c.execute("PRAGMA journal_mode=WAL")
+
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                conversation_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+            )
+        """)
+
+        # Rolling summary of turns that have scrolled out of the prompt window
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_memory (
+                conversation_id INTEGER PRIMARY KEY,
+                summary TEXT NOT NULL DEFAULT '',
+                summarized_upto INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (conversation_id) REFERENCES conversations(id)
+            )
+        """)
+
+        # Cached float32 embeddings of user turns, reused for follow-up retrieval
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS message_embeddings (
+                message_id INTEGER PRIMARY KEY,
+                conversation_id INTEGER NOT NULL,
+                embedding BLOB NOT NULL,
+                FOREIGN KEY (message_id) REFERENCES messages(id)
+            )
+        """)
+
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_messages_conversation
+            ON messages (conversation_id, id)
+        """)
+
+        c.execute("""
+            CREATE INDEX IF NOT EXISTS idx_conversations_created
+            ON conversations (created_at, id)
+        """)
+
+        _init_message_search(c)
+
+        conn.commit()
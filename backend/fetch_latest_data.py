@@ -17,17 +17,30 @@ def save_last_timestamp(timestamp):
         json.dump({"last_time": timestamp.isoformat()}, f)
 
 def fetch_new_entries(all_history):
+    """
+    Yield entries newer than the last run from a newest-first stream.
+    Stops reading at the first entry that is not newer, so only the new part
+    of the history is ever pulled from the browser DBs, and closes the stream
+    there so its sources are released. The new high-water mark is saved once
+    the stream has been fully consumed.
+    """
     last_time = load_last_timestamp()
-    if last_time:
-        # Keep only entries newer than last_time
-        new_entries = [e for e in all_history if e["time"] and e["time"] > last_time]
-    else:
-        # First run: treat all as new
-        new_entries = all_history
+    latest_time = None
+    try:
+        for entry in all_history:
+            if not entry.time:
+                continue
+            # Keep only entries newer than last_time (first run: treat all as new)
+            if last_time and entry.time <= last_time:
+                break
+            if latest_time is None:
+                latest_time = entry.time
+            yield entry
+    finally:
+        close = getattr(all_history, "close", None)
+        if close is not None:
+            close()
 
-    if new_entries:
+    if latest_time:
         # Save the most recent timestamp
-        latest_time = max(e["time"] for e in new_entries if e["time"])
         save_last_timestamp(latest_time)
-
-    return new_entries
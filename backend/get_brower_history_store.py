@@ -2,11 +2,15 @@ import os
 import sqlite3
 import shutil
 import uuid
+import heapq
+import itertools
+import typing as t
 from datetime import datetime, timedelta
 import platform
 import glob
 import chromadb
 from fetch_latest_data import fetch_new_entries
+from metrics import timed, count
 
 
 # ---- Timestamp Conversions ----
@@ -17,44 +21,75 @@ def firefox_time_to_datetime(firefox_time):
     return datetime.fromtimestamp(firefox_time / 1_000_000)
 
 
+# ---- Compact history record ----
+class HistoryEntry(t.NamedTuple):
+    """One visited URL. A plain tuple, so millions of rows stay cheap in memory."""
+    time: datetime
+    title: str
+    url: str
+
+
+STORE_BATCH = 500   # entries per ChromaDB add call
+FETCH_ROWS = 1000   # rows pulled from a browser DB cursor at a time
+
+
 # ---- DB Copy & Query ----
-def copy_and_query(db_path, query, time_converter):
-    """Copy a locked browser SQLite DB to a temp file and query it safely."""
+def copy_and_query(db_path, query, time_converter) -> t.Iterator[HistoryEntry]:
+    """
+    Copy a locked browser SQLite DB to a temp file and stream its rows.
+    `query` must return (url, title, visit_time) ordered by visit_time DESC;
+    rows are yielded in that order so several sources can be merged lazily.
+    """
     if not os.path.exists(db_path):
-        return []
+        return
     # Use a unique temp file per call to avoid collisions when querying multiple profiles
     temp_path = os.path.join(
         os.getenv("TEMP") or "/tmp",
         f"history_temp_{uuid.uuid4().hex[:8]}.sqlite"
     )
     try:
-        shutil.copy2(db_path, temp_path)
+        with timed("history_read"):
+            shutil.copy2(db_path, temp_path)
     except Exception as e:
         print(f"  [warn] Could not copy {db_path}: {e}")
-        return []
+        return
 
-    results = []
+    rows = 0
+    conn = None
     try:
         conn = sqlite3.connect(temp_path)
         cursor = conn.cursor()
-        cursor.execute(query)
-        for url, title, last_time in cursor.fetchall():
-            try:
-                last_time = time_converter(last_time) if last_time else None
-            except Exception:
-                last_time = None
-            results.append({"time": last_time, "title": title or "", "url": url})
-        conn.close()
+        with timed("history_read"):
+            cursor.execute(query)
+        while True:
+            # Time only the read + conversion; consumers run between yields
+            with timed("history_read"):
+                batch = cursor.fetchmany(FETCH_ROWS)
+                entries = []
+                for url, title, last_time in batch:
+                    if not last_time:
+                        continue
+                    try:
+                        last_time = time_converter(last_time)
+                    except Exception:
+                        # an undated row would break the time ordering of the stream
+                        continue
+                    entries.append(HistoryEntry(last_time, title or "", url))
+            if not batch:
+                break
+            rows += len(entries)
+            yield from entries
     except Exception as e:
         print(f"  [warn] Could not query {db_path}: {e}")
     finally:
+        if conn is not None:
+            conn.close()
+        count("history_read", rows)
         try:
             os.remove(temp_path)
         except Exception:
             pass
 
-    return results
-
 
 # ---- Path resolution helpers ----
 def _expand(path: str) -> str:
@@ -153,18 +188,20 @@ CHROMIUM_QUERY = (
 )
 
 def _fetch_chromium_browser(bases):
-    """Generic fetcher for any Chromium-based browser given a list of base dirs."""
-    results = []
+    """
+    Generic fetcher for any Chromium-based browser given a list of base dirs.
+    Returns one lazy, time-ordered row stream per profile.
+    """
+    streams = []
     seen_paths = set()
     for base in bases:
         for hist_path in _chromium_profile_dirs(base):
             if hist_path in seen_paths:
                 continue
             seen_paths.add(hist_path)
-            print(f"  Reading: {hist_path}")
-            rows = copy_and_query(hist_path, CHROMIUM_QUERY, chrome_time_to_datetime)
-            results.extend(rows)
-    return results
+            print(f"  Found: {hist_path}")
+            streams.append(copy_and_query(hist_path, CHROMIUM_QUERY, chrome_time_to_datetime))
+    return streams
 
 
 def get_chrome_history():
@@ -187,7 +224,7 @@ def get_firefox_history():
         "SELECT moz_places.url, moz_places.title, moz_places.last_visit_date "
         "FROM moz_places ORDER BY last_visit_date DESC"
     )
-    results = []
+    streams = []
     seen_paths = set()
     for parent_template in profile_parent_dirs:
         parent = _expand(parent_template)
@@ -201,84 +238,100 @@ def get_firefox_history():
             if db_path in seen_paths or not os.path.exists(db_path):
                 continue
             seen_paths.add(db_path)
-            print(f"  Reading: {db_path}")
-            results.extend(copy_and_query(db_path, query, firefox_time_to_datetime))
-    return results
+            print(f"  Found: {db_path}")
+            streams.append(copy_and_query(db_path, query, firefox_time_to_datetime))
+    return streams
 
 
-# ---- Dedup across browsers ----
-def deduplicate(history: list) -> list:
-    """Keep the most-recent entry per URL when the same URL appears in multiple browsers."""
-    best = {}
-    for entry in history:
-        url = entry["url"]
-        t = entry["time"] or datetime.min
-        if url not in best or t > (best[url]["time"] or datetime.min):
-            best[url] = entry
-    return list(best.values())
+# ---- Merge + dedup across browsers ----
+def merge_history(streams: t.Iterable[t.Iterator[HistoryEntry]]) -> t.Iterator[HistoryEntry]:
+    """
+    k-way merge of time-ordered streams, newest first. Because entries arrive
+    newest first, the first time a URL is seen is its most recent visit, so
+    duplicates across browsers/profiles are dropped on the fly. Closing the
+    merge closes every stream, so their DB copies are cleaned up right away.
+    """
+    streams = list(streams)
+    seen_urls = set()
+    try:
+        for entry in heapq.merge(*streams, key=lambda e: e.time, reverse=True):
+            if entry.url in seen_urls:
+                continue
+            seen_urls.add(entry.url)
+            yield entry
+    finally:
+        for stream in streams:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
 
 
 # ---- Store in ChromaDB ----
-def store_in_chromadb(history_data):
+def store_in_chromadb(history_data: t.Iterable[HistoryEntry]):
     client = chromadb.PersistentClient(path="./browser_history_db")
     collection = client.get_or_create_collection("browser_history")
 
-    existing = collection.get()
-    stored_urls = set(meta["url"] for meta in existing["metadatas"])
-
-    new_entries = [e for e in history_data if e["url"] not in stored_urls]
-
+    next_id = collection.count()
     added = 0
-    for i, entry in enumerate(new_entries, start=len(stored_urls)):
-        if not entry["time"]:
+    history_iter = iter(history_data)
+    while True:
+        batch = list(itertools.islice(history_iter, STORE_BATCH))
+        if not batch:
+            break
+
+        # Only look up the URLs in this batch instead of loading the whole collection
+        existing = collection.get(where={"url": {"$in": [e.url for e in batch]}}, include=["metadatas"])
+        stored_urls = set(meta["url"] for meta in existing["metadatas"])
+        new_entries = [e for e in batch if e.url not in stored_urls]
+        if not new_entries:
             continue
-        collection.add(
-            ids=[f"doc_{i}"],
-            documents=[f"{entry['title']} - {entry['url']}"],
-            metadatas={
-                "url": entry["url"],
-                "title": entry["title"],
-                "time": entry["time"].isoformat(),
-            },
-        )
-        added += 1
 
-    print(f"Added {added} new entries to ChromaDB (Total stored: {len(stored_urls) + added})")
+        # history_data is a lazy stream, so only the add itself counts as vector_add
+        with timed("vector_add"):
+            collection.add(
+                ids=[f"doc_{i}" for i in range(next_id, next_id + len(new_entries))],
+                documents=[f"{e.title} - {e.url}" for e in new_entries],
+                metadatas=[
+                    {"url": e.url, "title": e.title, "time": e.time.isoformat()}
+                    for e in new_entries
+                ],
+            )
+        next_id += len(new_entries)
+        added += len(new_entries)
+    count("vector_add", added)
+
+    print(f"Added {added} new entries to ChromaDB (Total stored: {next_id})")
 
 
 # ---- Main ----
 if __name__ == "__main__":
     print(f"Detected OS: {SYSTEM}\n")
 
-    all_history = []
+    streams = []
 
     print("[Chrome]")
-    chrome_hist = get_chrome_history()
-    print(f"  → {len(chrome_hist)} entries\n")
-    all_history.extend(chrome_hist)
+    streams.extend(get_chrome_history())
 
     print("[Edge]")
-    edge_hist = get_edge_history()
-    print(f"  → {len(edge_hist)} entries\n")
-    all_history.extend(edge_hist)
+    streams.extend(get_edge_history())
 
     print("[Firefox]")
-    firefox_hist = get_firefox_history()
-    print(f"  → {len(firefox_hist)} entries\n")
-    all_history.extend(firefox_hist)
-
-    # Deduplicate URLs across browsers, keep most-recent timestamp
-    all_history = deduplicate(all_history)
+    streams.extend(get_firefox_history())
 
-    # Sort by time descending
-    all_history = sorted(all_history, key=lambda x: x["time"] or datetime.min, reverse=True)
+    print(f"\nMerging {len(streams)} history databases...\n")
 
-    print(f"Total unique entries across all browsers: {len(all_history)}\n")
+    # Merge newest-first across browsers, keep most-recent visit per URL,
+    # stop at the last run's timestamp and store in batches as rows stream in
+    latest = []
+    def _remember_latest(entries):
+        for entry in entries:
+            if len(latest) < 5:
+                latest.append(entry)
+            yield entry
 
-    # Filter to only new entries since last run
-    new_entries = fetch_new_entries(all_history)
-    store_in_chromadb(new_entries)
+    new_entries = fetch_new_entries(merge_history(streams))
+    store_in_chromadb(_remember_latest(new_entries))
 
-    print("\nLatest 5 entries:")
-    for h in all_history[:5]:
-        print(h["time"], "-", h["title"][:60], "-", h["url"][:80])
\ No newline at end of file
+    print("\nLatest 5 new entries:")
+    for h in latest:
+        print(h.time, "-", h.title[:60], "-", h.url[:80])
@@ -1,14 +1,68 @@
 # main.py
-from fastapi import FastAPI
+import os
+import time
+import threading
+from contextlib import asynccontextmanager
+import typing as t
+from datetime import datetime
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-import sqlite3
+import metrics
+from metrics import timed
+import query
+import memory
+import search
 from query import query_knowledge_base
 from query import ask_ollama
-from db import init_db
+from db import init_db, get_conn, close_pool
+import chunk_store
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
-init_db()
+# Preload the vector store and Ollama models in the background after startup
+WARMUP_ON_START = os.getenv("BROWSER_RAG_WARMUP", "0").lower() in ("1", "true", "yes")
+
+# Run chunk retention + compaction in the background every N hours (0 = off)
+COMPACT_INTERVAL_HOURS = float(os.getenv("BROWSER_RAG_COMPACT_HOURS", "0"))
+
+startup_state = {"db": False, "warmup": "disabled", "warmup_error": None}
+
+
+def _run_warmup():
+    startup_state["warmup"] = "running"
+    try:
+        query.warm_up()
+        startup_state["warmup"] = "done"
+    except Exception as e:
+        print(f"[warn] Warm-up failed: {e}")
+        startup_state["warmup"] = "failed"
+        startup_state["warmup_error"] = str(e)
+
+
+def _run_compaction(stop: threading.Event):
+    while not stop.wait(COMPACT_INTERVAL_HOURS * 3600):
+        try:
+            chunk_store.run_maintenance(query.get_client())
+        except Exception as e:
+            print(f"[warn] Chunk compaction failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    startup_state["db"] = True
+    if WARMUP_ON_START:
+        startup_state["warmup"] = "pending"
+        threading.Thread(target=_run_warmup, name="warmup", daemon=True).start()
+    stop_compaction = threading.Event()
+    if COMPACT_INTERVAL_HOURS > 0:
+        threading.Thread(target=_run_compaction, args=(stop_compaction,), name="compaction", daemon=True).start()
+    yield
+    stop_compaction.set()
+    close_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,75 +70,143 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Use the route template so /conversations/{id} doesn't explode label cardinality
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - start, request.method, path, str(response.status_code))
+    return response
+
 class ChatRequest(BaseModel):
     conversation_id: int
     message: str
+    # Optional: only retrieve from pages visited in this range
+    since: t.Optional[datetime] = None
+    until: t.Optional[datetime] = None
 
 
 @app.post("/api/conversations")
 def create_conversation():
-    conn = sqlite3.connect("chat.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO conversations (title) VALUES ('New Conversation')")
-    conn.commit()
-    conv_id = c.lastrowid
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO conversations (title) VALUES ('New Conversation')")
+        conn.commit()
+        conv_id = c.lastrowid
     return {"id": conv_id}
 
 @app.get("/api/conversations")
-def list_conversations():
-    conn = sqlite3.connect("chat.db")
-    c = conn.cursor()
-    c.execute("SELECT id, title, created_at FROM conversations ORDER BY created_at DESC")
-    data = [{"id": row[0], "title": row[1], "created_at": row[2]} for row in c.fetchall()]
-    conn.close()
+def list_conversations(response: Response,
+                       limit: t.Optional[int] = Query(None, ge=1, le=200),
+                       cursor: t.Optional[str] = None):
+    # Without `limit` every conversation is returned, as before. With it, the
+    # cursor for the next page is sent back in the X-Next-Cursor header.
+    try:
+        with get_conn() as conn:
+            data, next_cursor = search.list_conversations_page(conn, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return data
 
+@app.get("/api/search")
+def search_messages(q: str = Query(..., min_length=1, max_length=500),
+                    limit: int = Query(20, ge=1, le=100),
+                    offset: int = Query(0, ge=0)):
+    with timed("search"), get_conn() as conn:
+        return search.search_messages(conn, q, limit, offset)
+
 @app.get("/api/conversations/{conversation_id}/messages")
 def get_messages(conversation_id: int):
-    conn = sqlite3.connect("chat.db")
-    c = conn.cursor()
-    c.execute("SELECT role, content FROM messages WHERE conversation_id=? ORDER BY created_at ASC", (conversation_id,))
-    data = [{"role": row[0], "content": row[1]} for row in c.fetchall()]
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("SELECT role, content FROM messages WHERE conversation_id=? ORDER BY created_at ASC", (conversation_id,))
+        data = [{"role": row[0], "content": row[1]} for row in c.fetchall()]
     return data
 
 @app.post("/api/chat")
-def chat(req: ChatRequest):
-    conn = sqlite3.connect("chat.db")
-    c = conn.cursor()
+def chat(req: ChatRequest, background_tasks: BackgroundTasks):
+    with metrics.trace("chat", conversation_id=req.conversation_id):
+        # Load the prompt window, rolling summary and cached turn embeddings
+        with timed("history_load"), get_conn() as conn:
+            history = memory.load_history(conn, req.conversation_id)
+            turns = memory.recent_user_turns(history)
+            cached = memory.cached_turn_embeddings(conn, turns)
 
-    # Save user message
-    c.execute("INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
-              (req.conversation_id, "user", req.message))
+        # The question and any turns missing from the cache share one embedding batch
+        missing = [(mid, content) for mid, content in turns if mid not in cached]
+        vectors = query.embed_queries([req.message] + [content for _, content in missing])
+        question_vec = vectors[0]
+        fresh = {mid: vec for (mid, _), vec in zip(missing, vectors[1:])}
+        turn_vecs = [cached[mid] if mid in cached else fresh[mid] for mid, _ in turns]
 
-    # Get RAG answer
-    docs = query_knowledge_base(req.message)
-    combined_context = "\n\n".join(docs)
-    answer = ask_ollama(req.message, combined_context)
+        # Save user message together with its embedding for later follow-ups
+        with timed("db_write"), get_conn() as conn:
+            c = conn.execute("INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                             (req.conversation_id, "user", req.message))
+            memory.save_turn_embedding(conn, c.lastrowid, req.conversation_id, question_vec)
+            for mid, vec in fresh.items():
+                memory.save_turn_embedding(conn, mid, req.conversation_id, vec)
+            conn.commit()
 
-    # Save assistant message
-    c.execute("INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
-              (req.conversation_id, "assistant", answer))
+        # Get RAG answer (no pooled connection is held while the model generates)
+        retrieval_vec = memory.blend_query(question_vec, turn_vecs)
+        docs = query_knowledge_base(req.message, query_embedding=retrieval_vec,
+                                    since=req.since, until=req.until)
+        combined_context = "\n\n".join(docs)
+        answer = ask_ollama(req.message, combined_context, memory.format_history(history))
 
-    conn.commit()
-    conn.close()
+        # Save assistant message
+        with timed("db_write"), get_conn() as conn:
+            conn.execute("INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                         (req.conversation_id, "assistant", answer))
+            conn.commit()
 
+    background_tasks.add_task(memory.refresh_summary, req.conversation_id, query.summarize_conversation)
     return {"response": answer}
 
 
 # Add this to your main.py
 @app.delete("/api/conversations/{conversation_id}")
 def delete_conversation(conversation_id: int):
-    conn = sqlite3.connect("chat.db")
-    c = conn.cursor()
-    
-    # Delete messages first to maintain referential integrity
-    c.execute("DELETE FROM messages WHERE conversation_id=?", (conversation_id,))
-    c.execute("DELETE FROM conversations WHERE id=?", (conversation_id,))
-    
-    conn.commit()
-    conn.close()
-    return {"status": "success"}
\ No newline at end of file
+    with get_conn() as conn:
+        c = conn.cursor()
+
+        # Delete messages first to maintain referential integrity
+        memory.delete_memory(conn, conversation_id)
+        c.execute("DELETE FROM messages WHERE conversation_id=?", (conversation_id,))
+        c.execute("DELETE FROM conversations WHERE id=?", (conversation_id,))
+
+        conn.commit()
+    return {"status": "success"}
+
+
+@app.get("/healthz")
+def healthz():
+    # Liveness: the process is up and serving requests
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz():
+    ready = startup_state["db"] and startup_state["warmup"] not in ("pending", "running")
+    body = {
+        "status": "ready" if ready else "starting",
+        "db": startup_state["db"],
+        "vector_store": query.is_initialized(),
+        "warmup": startup_state["warmup"],
+    }
+    if startup_state["warmup_error"]:
+        body["warmup_error"] = startup_state["warmup_error"]
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,170 @@
+import math
+import typing as t
+from array import array
+
+from db import get_conn
+from metrics import timed
+
+# ----- CONFIG -----
+HISTORY_WINDOW = 6          # most recent messages passed verbatim to the model
+MAX_TURN_CHARS = 1000       # truncate long turns in the prompt window
+MEMORY_USER_TURNS = 3       # earlier user turns blended into the retrieval query
+TURN_DECAY = 0.35           # weight of the previous user turn; older ones decay geometrically
+SUMMARY_BATCH = 4           # fold messages into the summary once this many have left the window
+
+
+# ----------------------------
+# Embedding storage
+# ----------------------------
+def pack_embedding(vec: t.Sequence[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def unpack_embedding(blob: bytes) -> t.List[float]:
+    vec = array("f")
+    vec.frombytes(blob)
+    return vec.tolist()
+
+
+def save_turn_embedding(conn, message_id: int, conversation_id: int, vec: t.Sequence[float]) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO message_embeddings (message_id, conversation_id, embedding) VALUES (?, ?, ?)",
+        (message_id, conversation_id, pack_embedding(vec)),
+    )
+
+
+# ----------------------------
+# History loading
+# ----------------------------
+def load_history(conn, conversation_id: int) -> dict:
+    """
+    Return the rolling summary and every message it does not cover yet
+    (oldest first). The summary only absorbs messages in batches of
+    SUMMARY_BATCH, so up to SUMMARY_BATCH - 1 messages older than the window
+    are still carried verbatim instead of being dropped from the prompt.
+    """
+    row = conn.execute(
+        "SELECT summary, summarized_upto FROM conversation_memory WHERE conversation_id=?",
+        (conversation_id,),
+    ).fetchone()
+    summary, summarized_upto = row if row else ("", 0)
+    rows = conn.execute(
+        "SELECT id, role, content FROM messages WHERE conversation_id=? AND id>? ORDER BY id DESC LIMIT ?",
+        (conversation_id, summarized_upto, HISTORY_WINDOW + SUMMARY_BATCH),
+    ).fetchall()
+    return {"summary": summary, "messages": rows[::-1]}
+
+
+def format_history(history: dict) -> str:
+    parts = []
+    if history["summary"]:
+        parts.append(f"Summary of earlier turns: {history['summary']}")
+    for _, role, content in history["messages"]:
+        if len(content) > MAX_TURN_CHARS:
+            content = content[:MAX_TURN_CHARS] + " ..."
+        parts.append(f"{role.capitalize()}: {content}")
+    return "\n\n".join(parts)
+
+
+# ----------------------------
+# Conversation-aware retrieval query
+# ----------------------------
+def recent_user_turns(history: dict) -> t.List[t.Tuple[int, str]]:
+    """(message_id, content) of the most recent user turns, newest first."""
+    turns = [(mid, content) for mid, role, content in reversed(history["messages"]) if role == "user"]
+    return turns[:MEMORY_USER_TURNS]
+
+
+def cached_turn_embeddings(conn, turns: t.List[t.Tuple[int, str]]) -> t.Dict[int, t.List[float]]:
+    """
+    Cached embeddings for `turns`, keyed by message id. Turns that predate the
+    cache are missing; the caller embeds them (without holding a connection)
+    and stores them with save_turn_embedding.
+    """
+    if not turns:
+        return {}
+    ids = [mid for mid, _ in turns]
+    placeholders = ",".join("?" * len(ids))
+    rows = conn.execute(
+        f"SELECT message_id, embedding FROM message_embeddings WHERE message_id IN ({placeholders})", ids
+    ).fetchall()
+    return {mid: unpack_embedding(blob) for mid, blob in rows}
+
+
+def _normalize(vec: t.Sequence[float]) -> t.List[float]:
+    norm = math.sqrt(sum(x * x for x in vec))
+    return [x / norm for x in vec] if norm else list(vec)
+
+
+def blend_query(question_vec: t.Sequence[float], turn_vecs: t.List[t.List[float]]) -> t.List[float]:
+    """
+    Condense the question and earlier user turns into a single standalone query
+    vector. The question dominates; each older turn contributes geometrically less,
+    so follow-ups like "and how do I configure it?" inherit the earlier topic.
+    """
+    blended = _normalize(question_vec)
+    weight = TURN_DECAY
+    for vec in turn_vecs:
+        if len(vec) != len(blended):
+            continue
+        for i, x in enumerate(_normalize(vec)):
+            blended[i] += weight * x
+        weight *= TURN_DECAY
+    return _normalize(blended)
+
+
+# ----------------------------
+# Rolling summary
+# ----------------------------
+def refresh_summary(conversation_id: int, summarize: t.Callable[[str, str], str]) -> None:
+    """
+    Fold messages that have scrolled out of the prompt window into the stored
+    summary. Runs after the response is sent and only calls the model once
+    SUMMARY_BATCH new messages have left the window.
+    """
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT summary, summarized_upto FROM conversation_memory WHERE conversation_id=?",
+            (conversation_id,),
+        ).fetchone()
+        summary, summarized_upto = row if row else ("", 0)
+
+        window = conn.execute(
+            "SELECT id FROM messages WHERE conversation_id=? ORDER BY id DESC LIMIT ?",
+            (conversation_id, HISTORY_WINDOW),
+        ).fetchall()
+        if len(window) < HISTORY_WINDOW:
+            return
+        window_start = window[-1][0]
+
+        pending = conn.execute(
+            "SELECT id, role, content FROM messages "
+            "WHERE conversation_id=? AND id>? AND id<? ORDER BY id ASC",
+            (conversation_id, summarized_upto, window_start),
+        ).fetchall()
+
+    if len(pending) < SUMMARY_BATCH:
+        return
+
+    transcript = "\n\n".join(
+        f"{role.capitalize()}: {content[:MAX_TURN_CHARS]}" for _, role, content in pending
+    )
+    try:
+        new_summary = summarize(summary, transcript)
+    except Exception as e:
+        print(f"[memory] Could not update summary for conversation {conversation_id}: {e}")
+        return
+
+    with timed("db_write"), get_conn() as conn:
+        conn.execute(
+            "INSERT INTO conversation_memory (conversation_id, summary, summarized_upto) VALUES (?, ?, ?) "
+            "ON CONFLICT(conversation_id) DO UPDATE SET "
+            "summary=excluded.summary, summarized_upto=excluded.summarized_upto, updated_at=CURRENT_TIMESTAMP",
+            (conversation_id, new_summary, pending[-1][0]),
+        )
+        conn.commit()
+
+
+def delete_memory(conn, conversation_id: int) -> None:
+    conn.execute("DELETE FROM message_embeddings WHERE conversation_id=?", (conversation_id,))
+    conn.execute("DELETE FROM conversation_memory WHERE conversation_id=?", (conversation_id,))
@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+import typing as t
+from contextlib import contextmanager
+
+
+# ----------------------------
+# Config
+# ----------------------------
+METRICS_PREFIX = "browser_rag"
+TRACE_ENABLED = os.getenv("BROWSER_RAG_TRACE", "0").lower() in ("1", "true", "yes")
+
+# Seconds. Spans sub-millisecond DB writes up to multi-minute LLM generations.
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+trace_logger = logging.getLogger("browser_rag.trace")
+if TRACE_ENABLED and not trace_logger.handlers:
+    trace_logger.addHandler(logging.StreamHandler())
+    trace_logger.setLevel(logging.INFO)
+
+
+# ----------------------------
+# Metric types
+# ----------------------------
+def _format_labels(labelnames: t.Sequence[str], values: t.Sequence[str], extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter keyed by label values."""
+
+    def __init__(self, name: str, help: str, labelnames: t.Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: t.Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labelvalues: str) -> None:
+        key = tuple(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        return self._values.get(tuple(labelvalues), 0)
+
+    def render(self) -> t.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, val in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(val)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram keyed by label values."""
+
+    def __init__(self, name: str, help: str, labelnames: t.Sequence[str] = (),
+                 buckets: t.Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label key: [bucket counts..., +Inf count], sum
+        self._series: t.Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        key = tuple(labelvalues)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][idx] += 1
+            series[1] += value
+
+    def count(self, *labelvalues: str) -> int:
+        series = self._series.get(tuple(labelvalues))
+        return sum(series[0]) if series else 0
+
+    def render(self) -> t.List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# ----------------------------
+# Registry
+# ----------------------------
+_registry: t.List[t.Union[Counter, Histogram]] = []
+
+
+def counter(name: str, help: str, labelnames: t.Sequence[str] = ()) -> Counter:
+    metric = Counter(f"{METRICS_PREFIX}_{name}", help, labelnames)
+    _registry.append(metric)
+    return metric
+
+
+def histogram(name: str, help: str, labelnames: t.Sequence[str] = (),
+              buckets: t.Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    metric = Histogram(f"{METRICS_PREFIX}_{name}", help, labelnames, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def render_prometheus() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = histogram(
+    "stage_duration_seconds",
+    "Latency of pipeline stages (history read, fetch, parse, chunk, embed, ...).",
+    ("stage",),
+)
+STAGE_ERRORS = counter(
+    "stage_errors_total",
+    "Pipeline stages that raised an exception.",
+    ("stage",),
+)
+ITEMS = counter(
+    "items_total",
+    "Items processed per stage (rows read, pages fetched, chunks embedded, ...).",
+    ("stage",),
+)
+HTTP_SECONDS = histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests served by the API.",
+    ("method", "route", "status"),
+)
+
+
+# ----------------------------
+# Per-request traces
+# ----------------------------
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("browser_rag_trace", default=None)
+
+
+@contextmanager
+def trace(name: str, **fields):
+    """
+    Collect the stage timings recorded inside this block into a single trace.
+    When tracing is enabled (BROWSER_RAG_TRACE=1) the trace is logged as one JSON line.
+    """
+    if not TRACE_ENABLED:
+        yield None
+        return
+    spans: t.List[tuple] = []
+    token = _current_trace.set(spans)
+    start = time.perf_counter()
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+        total = time.perf_counter() - start
+        record = {
+            "trace": name,
+            "total_ms": round(total * 1000, 3),
+            "spans": [{"stage": s, "ms": round(d * 1000, 3)} for s, d in spans],
+        }
+        record.update(fields)
+        trace_logger.info(json.dumps(record, default=str))
+
+
+# ----------------------------
+# Stage timing
+# ----------------------------
+def observe(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage)
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def capture_spans():
+    """
+    Collect the spans recorded inside this block into a fresh list, e.g. on a
+    worker thread whose work belongs to other requests' traces.
+    """
+    spans: t.List[tuple] = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+
+def current_spans() -> t.Optional[t.List[tuple]]:
+    """Span list of the active trace, or None outside a trace."""
+    return _current_trace.get()
+
+
+def count(stage: str, amount: float = 1) -> None:
+    ITEMS.inc(amount, stage)
+
+
+@contextmanager
+def timed(stage: str):
+    """Time a block (or, used as a decorator, a function) under the given stage label."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(1, stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start)
@@ -1,48 +1,202 @@
-import chromadb
-from chromadb.utils import embedding_functions
+import os
 import requests
 import json
+import time
 import subprocess
+import threading
+from datetime import datetime
+
+from metrics import timed, count
+from batching import MicroBatcher
+import chunk_store
 
 # ----- CONFIG -----
-CHROMA_COLLECTION = "page_chunks"  # The collection with HTML chunks
+CHROMA_PATH = chunk_store.CHUNKS_DB_PATH  # Monthly page_chunks_YYYY_MM segments
+SEGMENT_REFRESH_SECONDS = 60               # pick up segments added/dropped by ingestion and retention
+SNAPSHOT_PATH = os.getenv("BROWSER_RAG_SNAPSHOT")  # serve retrieval from a snapshot archive via mmap instead
 OLLAMA_MODEL = "llama3.2"
+OLLAMA_EMBED_MODEL = chunk_store.EMBED_MODEL  # must match the vectors in the index
+OLLAMA_GENERATE_URL = "http://localhost:11434/api/generate"
 RETRIEVAL_LIMIT = 5
+BATCH_WINDOW_MS = 5          # how long concurrent queries wait to share one embed/search call
+MAX_BATCH = 32
+
+# Chroma client, embedding function and segments are opened on first use
+# (or by warm_up()) so importing this module stays cheap.
+_client = None
+_embedding_func = None
+_segments = None
+_segments_loaded_at = 0.0
+_snapshot = None
+_init_lock = threading.Lock()
+
+
+def get_embedding_func():
+    global _embedding_func
+    if _embedding_func is None:
+        with _init_lock:
+            if _embedding_func is None:
+                from chromadb.utils import embedding_functions
+                with timed("init_embedding_client"):
+                    _embedding_func = embedding_functions.OllamaEmbeddingFunction(
+                        model_name=OLLAMA_EMBED_MODEL
+                    )
+    return _embedding_func
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _init_lock:
+            if _client is None:
+                import chromadb
+                with timed("init_vector_client"):
+                    _client = chromadb.PersistentClient(path=CHROMA_PATH)
+    return _client
+
+
+def get_segments() -> dict:
+    """Open chunk segments by name, refreshed every SEGMENT_REFRESH_SECONDS."""
+    global _segments, _segments_loaded_at
+    if _segments is None or time.monotonic() - _segments_loaded_at > SEGMENT_REFRESH_SECONDS:
+        client = get_client()
+        embedding_func = get_embedding_func()
+        with _init_lock:
+            _segments = chunk_store.open_segments(client, embedding_func)
+            _segments_loaded_at = time.monotonic()
+    return _segments
+
+
+def get_snapshot():
+    global _snapshot
+    if _snapshot is None:
+        with _init_lock:
+            if _snapshot is None:
+                from snapshot import SnapshotIndex
+                with timed("init_vector_client"):
+                    _snapshot = SnapshotIndex(SNAPSHOT_PATH)
+    return _snapshot
+
+
+def is_initialized() -> bool:
+    return _segments is not None or _snapshot is not None
+
+
+def warm_up():
+    """Open the vector store and load the embedding and chat models into Ollama."""
+    if SNAPSHOT_PATH:
+        get_snapshot()
+    else:
+        get_segments()
+    with timed("warmup_embed"):
+        get_embedding_func()(["warm up"])
+    # A generate request without a prompt just loads the model into memory
+    with timed("warmup_generate"):
+        requests.post(OLLAMA_GENERATE_URL, json={"model": OLLAMA_MODEL}, timeout=300)
+    print("[RAG] Warm-up complete")
+
+
+def _embed_batch(texts: list) -> list:
+    with timed("query_embed"):
+        return [list(vec) for vec in get_embedding_func()(texts)]
+
+
+def _search(query_embeddings: list, n_results: int, since, until) -> list:
+    if SNAPSHOT_PATH:
+        # A snapshot replica serves retrieval from its memory-mapped vectors
+        return get_snapshot().query(query_embeddings, n_results, since, until)
+    return chunk_store.query_segments(get_segments(), query_embeddings, n_results, since, until)
+
+
+def _search_batch(queries: list) -> list:
+    """
+    Run one multi-query search per time window for (embedding, n_results,
+    since, until) tuples, fanning out only to the matching monthly segments.
+    """
+    results = [None] * len(queries)
+    by_window: dict = {}
+    for i, (_, _, since, until) in enumerate(queries):
+        by_window.setdefault((since, until), []).append(i)
 
-# Connect to Chroma DB
-client = chromadb.PersistentClient(path="./page_chunks_db")
-embedding_func = embedding_functions.OllamaEmbeddingFunction(
-    model_name="nomic-embed-text"
-)
-
-collection = client.get_or_create_collection(
-    name=CHROMA_COLLECTION,
-    embedding_function=embedding_func
-)
-
-def query_knowledge_base(question: str, n_results=RETRIEVAL_LIMIT):
-    results = collection.query(
-        query_texts=[question],
-        n_results=n_results
-    )
-    documents = results.get("documents", [[]])[0]
+    for (since, until), idxs in by_window.items():
+        n_max = max(queries[i][1] for i in idxs)
+        with timed("retrieve"):
+            documents = _search([list(queries[i][0]) for i in idxs], n_max, since, until)
+        for i, docs in zip(idxs, documents):
+            results[i] = docs[:queries[i][1]]
+    return results
+
+
+_embed_batcher = MicroBatcher("embed", _embed_batch, BATCH_WINDOW_MS, MAX_BATCH)
+_search_batcher = MicroBatcher("search", _search_batch, BATCH_WINDOW_MS, MAX_BATCH)
+
+
+def embed_query(text: str) -> list:
+    # Concurrent calls are batched into one embedding request; identical texts share a result
+    return _embed_batcher(text, text)
+
+
+def embed_queries(texts: list) -> list:
+    """Embed several texts; submitted together, they go out in the same batch."""
+    futures = [_embed_batcher.submit(text, text) for text in texts]
+    return [f.result() for f in futures]
+
+
+def query_knowledge_base(question: str, n_results=RETRIEVAL_LIMIT, query_embedding=None,
+                         since: datetime = None, until: datetime = None):
+    """
+    Retrieve the chunks closest to `question`, or to `query_embedding` when the
+    caller has already built one (e.g. blended with earlier conversation turns).
+    `since`/`until` restrict the search to pages visited in that time range.
+    """
+    if query_embedding is None:
+        query_embedding = embed_query(question)
+    key = (tuple(query_embedding), n_results, since, until)
+    documents = _search_batcher(key, key)
     print(f"\n[RAG] Query: {question}")
     print(f"[RAG] Retrieved {len(documents)} chunks")
     for i, doc in enumerate(documents):
         print(f"  [{i}] {doc[:120]}")
+    count("retrieve", len(documents))
     return documents
 
-def ask_ollama(question: str, context: str) -> str:
-    prompt = f"""You are a personal knowledge assistant with access to the user's browser history and the web pages they have visited.
+def ask_ollama(question: str, context: str, history: str = "") -> str:
+    with timed("prompt_build"):
+        prompt = build_prompt(question, context, history)
+
+    with timed("generate"):
+        process = subprocess.Popen(
+            ["ollama", "run", OLLAMA_MODEL],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        output, _ = process.communicate(prompt)
+    print(output.strip())
+    return output.strip()
+
+def build_prompt(question: str, context: str, history: str = "") -> str:
+    conversation = ""
+    if history:
+        conversation = f"""
+Earlier in this conversation:
+
+<conversation>
+{history}
+</conversation>
+"""
+    return f"""You are a personal knowledge assistant with access to the user's browser history and the web pages they have visited.
 
 Below is relevant content retrieved from pages the user has previously browsed. Use it to answer their question as helpfully as possible.
 
 <context>
 {context}
 </context>
-
+{conversation}
 <instructions>
 - Answer using the context above as your primary source.
+- Use the conversation, if any, to resolve follow-up questions such as "and how do I configure it?".
 - If the context is relevant, summarise and explain it clearly in Markdown.
 - If the context is partially relevant, use what applies and say what you could not find.
 - Only say you lack information if the context is completely unrelated to the question.
@@ -54,17 +208,27 @@ Question: {question}
 
 Answer:"""
 
-    
-    process = subprocess.Popen(
-        ["ollama", "run", OLLAMA_MODEL],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    output, _ = process.communicate(prompt)
-    print(output.strip())
-    return output.strip()
+def summarize_conversation(previous_summary: str, transcript: str) -> str:
+    """Fold older conversation turns into a short rolling summary."""
+    prompt = f"""Update the running summary of a conversation between a user and an assistant.
+
+<summary>
+{previous_summary or "(empty)"}
+</summary>
+
+<new_turns>
+{transcript}
+</new_turns>
+
+Write the updated summary in at most 150 words. Keep topics, names, tools and open questions the user may refer back to. Output only the summary."""
+    with timed("summarize"):
+        r = requests.post(
+            OLLAMA_GENERATE_URL,
+            json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False},
+            timeout=300,
+        )
+        r.raise_for_status()
+    return (r.json().get("response") or "").strip()
 
 if __name__ == "__main__":
     user_query = input("Enter your question: ")
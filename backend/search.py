@@ -0,0 +1,119 @@
+import re
+import html
+import json
+import base64
+import typing as t
+
+# ----- CONFIG -----
+SNIPPET_TOKENS = 12         # words of context around each highlighted hit
+HIGHLIGHT_OPEN = "<mark>"
+HIGHLIGHT_CLOSE = "</mark>"
+# Private-use characters that FTS5 wraps hits in before the snippet is escaped
+_SENTINEL_OPEN = "\ue000"
+_SENTINEL_CLOSE = "\ue001"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+# ----------------------------
+# Message search (FTS5)
+# ----------------------------
+def fts_query(text: str) -> str:
+    """
+    Turn free text into a safe FTS5 MATCH expression: every word is quoted
+    (so punctuation can't be parsed as query syntax) and the last word is a
+    prefix match, which makes search-as-you-type work.
+    """
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        return ""
+    terms = [f'"{tok}"' for tok in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def render_snippet(raw: str) -> str:
+    """
+    HTML-escape a snippet (message text may contain markup from scraped pages
+    or model output), then turn the hit sentinels into <mark> tags.
+    """
+    escaped = html.escape(raw)
+    return escaped.replace(_SENTINEL_OPEN, HIGHLIGHT_OPEN).replace(_SENTINEL_CLOSE, HIGHLIGHT_CLOSE)
+
+
+def search_messages(conn, text: str, limit: int = 20, offset: int = 0) -> dict:
+    """Ranked, snippet-highlighted search over every stored message."""
+    match = fts_query(text)
+    if not match:
+        return {"results": [], "next_offset": None}
+
+    rows = conn.execute(
+        f"""
+        SELECT m.id, m.conversation_id, c.title, m.role, m.created_at,
+               snippet(messages_fts, 0, ?, ?, '…', {SNIPPET_TOKENS})
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        JOIN conversations c ON c.id = m.conversation_id
+        WHERE messages_fts MATCH ?
+        ORDER BY messages_fts.rank
+        LIMIT ? OFFSET ?
+        """,
+        (_SENTINEL_OPEN, _SENTINEL_CLOSE, match, limit + 1, offset),
+    ).fetchall()
+
+    # One extra row tells us whether another page exists without a COUNT(*)
+    has_more = len(rows) > limit
+    results = [
+        {
+            "message_id": row[0],
+            "conversation_id": row[1],
+            "conversation_title": row[2],
+            "role": row[3],
+            "created_at": row[4],
+            "snippet": render_snippet(row[5]),
+        }
+        for row in rows[:limit]
+    ]
+    return {"results": results, "next_offset": offset + limit if has_more else None}
+
+
+# ----------------------------
+# Conversation list pagination
+# ----------------------------
+def encode_cursor(created_at: str, conv_id: int) -> str:
+    raw = json.dumps([created_at, conv_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> t.Tuple[str, int]:
+    """Raises ValueError for cursors that were not produced by encode_cursor."""
+    try:
+        created_at, conv_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(created_at), int(conv_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def list_conversations_page(conn, limit: t.Optional[int] = None,
+                            cursor: t.Optional[str] = None) -> t.Tuple[list, t.Optional[str]]:
+    """
+    Newest-first conversations after `cursor` (keyset pagination on
+    created_at, id). Returns the page and the cursor for the next one.
+    """
+    sql = "SELECT id, title, created_at FROM conversations"
+    params: list = []
+    if cursor:
+        sql += " WHERE (created_at, id) < (?, ?)"
+        params.extend(decode_cursor(cursor))
+    sql += " ORDER BY created_at DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][2], rows[-1][0])
+    data = [{"id": row[0], "title": row[1], "created_at": row[2]} for row in rows]
+    return data, next_cursor
@@ -0,0 +1,308 @@
+"""
+Portable snapshots of the page chunk index.
+
+A snapshot is an uncompressed tar holding:
+  manifest.json     format version, vector shape, segment layout, sha256 of every file
+  vectors.f32       row-major float32 embeddings (count x dim), memory-mappable in place
+  records.jsonl     one {"id", "document", "metadata"} line per vector row, same order
+  state/*.json      ingestion state (seen_urls.json, last_fetched.json)
+"""
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tarfile
+import argparse
+import tempfile
+import typing as t
+from array import array
+from datetime import datetime
+
+import chunk_store
+from metrics import timed, count
+
+# ----------------------------
+# Config
+# ----------------------------
+SNAPSHOT_FORMAT = "browser-rag-snapshot"
+SNAPSHOT_VERSION = 1
+EXPORT_BATCH = 1000
+IMPORT_BATCH = 1000
+STATE_FILES = ("seen_urls.json", "last_fetched.json")
+HASH_BLOCK = 1 << 20
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _sha256_member(tar: tarfile.TarFile, name: str) -> str:
+    h = hashlib.sha256()
+    f = tar.extractfile(name)
+    for block in iter(lambda: f.read(HASH_BLOCK), b""):
+        h.update(block)
+    return h.hexdigest()
+
+
+# ----------------------------
+# Export
+# ----------------------------
+@timed("snapshot_export")
+def export_snapshot(client, out_path: str, embed_model: str = "") -> dict:
+    """Stream every chunk segment into a snapshot archive. Returns the manifest."""
+    segments = chunk_store.open_segments(client)
+    with tempfile.TemporaryDirectory() as tmp:
+        vec_path = os.path.join(tmp, "vectors.f32")
+        rec_path = os.path.join(tmp, "records.jsonl")
+        dim = None
+        total = 0
+        layout = []
+
+        with open(vec_path, "wb") as vf, open(rec_path, "w", encoding="utf-8") as rf:
+            for name, coll in segments.items():
+                start = total
+                offset = 0
+                while True:
+                    batch = coll.get(limit=EXPORT_BATCH, offset=offset,
+                                     include=["documents", "metadatas", "embeddings"])
+                    ids = batch.get("ids") or []
+                    if not ids:
+                        break
+                    for chunk_id, doc, meta, vec in zip(ids, batch["documents"], batch["metadatas"], batch["embeddings"]):
+                        if dim is None:
+                            dim = len(vec)
+                        if len(vec) != dim:
+                            raise SnapshotError(f"{chunk_id}: embedding has {len(vec)} dims, expected {dim}")
+                        array("f", vec).tofile(vf)
+                        rf.write(json.dumps({"id": chunk_id, "document": doc, "metadata": meta}, ensure_ascii=False))
+                        rf.write("\n")
+                    total += len(ids)
+                    offset += len(ids)
+                layout.append({"name": name, "start": start, "count": total - start})
+
+        state_paths = {f"state/{fn}": fn for fn in STATE_FILES if os.path.exists(fn)}
+        files = {"vectors.f32": vec_path, "records.jsonl": rec_path, **state_paths}
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "created_at": datetime.now().isoformat(),
+            "embed_model": embed_model,
+            "dtype": "float32",
+            "byteorder": sys.byteorder,
+            "count": total,
+            "dim": dim or 0,
+            "segments": layout,
+            "files": {arc: {"sha256": _sha256_file(p), "size": os.path.getsize(p)} for arc, p in files.items()},
+        }
+        man_path = os.path.join(tmp, "manifest.json")
+        with open(man_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Uncompressed, so vectors.f32 stays contiguous and can be mmapped from the archive
+        tmp_out = f"{out_path}.tmp"
+        with tarfile.open(tmp_out, "w", format=tarfile.PAX_FORMAT) as tar:
+            tar.add(man_path, arcname="manifest.json")
+            for arc, p in files.items():
+                tar.add(p, arcname=arc)
+        os.replace(tmp_out, out_path)
+
+    count("snapshot_export", total)
+    print(f"[snapshot] Exported {total} chunks ({manifest['dim']} dims) from {len(layout)} segments to {out_path}")
+    return manifest
+
+
+# ----------------------------
+# Reading / verification
+# ----------------------------
+def read_manifest(tar: tarfile.TarFile) -> dict:
+    try:
+        manifest = json.load(tar.extractfile("manifest.json"))
+    except KeyError:
+        raise SnapshotError("Not a snapshot: manifest.json missing")
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"Not a snapshot: format {manifest.get('format')!r}")
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {manifest.get('version')} (expected {SNAPSHOT_VERSION})")
+    if manifest.get("byteorder") != sys.byteorder:
+        raise SnapshotError(f"Snapshot byte order {manifest.get('byteorder')} does not match this machine")
+    return manifest
+
+
+@timed("snapshot_verify")
+def verify_snapshot(path: str) -> dict:
+    """Check format, version and every file checksum. Returns the manifest."""
+    with tarfile.open(path, "r:") as tar:
+        manifest = read_manifest(tar)
+        for name, info in manifest["files"].items():
+            try:
+                member = tar.getmember(name)
+            except KeyError:
+                raise SnapshotError(f"{name} missing from snapshot")
+            if member.size != info["size"] or _sha256_member(tar, name) != info["sha256"]:
+                raise SnapshotError(f"{name} checksum mismatch")
+    expected = manifest["count"] * manifest["dim"] * 4
+    if manifest["files"]["vectors.f32"]["size"] != expected:
+        raise SnapshotError("vectors.f32 size does not match count x dim")
+    return manifest
+
+
+def check_embed_model(manifest: dict, model: str = chunk_store.EMBED_MODEL) -> None:
+    """Vectors from a different embedding model can't be searched with this one's queries."""
+    snap_model = manifest.get("embed_model")
+    if snap_model and snap_model != model:
+        raise SnapshotError(f"Snapshot was embedded with {snap_model!r}, this index uses {model!r}")
+
+
+def _iter_records(tar: tarfile.TarFile) -> t.Iterator[dict]:
+    for line in tar.extractfile("records.jsonl"):
+        yield json.loads(line)
+
+
+# ----------------------------
+# Import
+# ----------------------------
+@timed("snapshot_import")
+def import_snapshot(client, path: str, with_state: bool = False) -> int:
+    """
+    Verify the archive, then bulk-load it into the chunk segments in one pass
+    (stored vectors are reused, nothing is re-embedded). Returns chunks loaded.
+    """
+    manifest = verify_snapshot(path)
+    check_embed_model(manifest)
+    dim = manifest["dim"]
+    loaded = 0
+    with tarfile.open(path, "r:") as tar:
+        vectors = tar.extractfile("vectors.f32")
+        records = _iter_records(tar)
+        for seg in manifest["segments"]:
+            coll = chunk_store.get_segment(client, seg["name"])
+            remaining = seg["count"]
+            while remaining:
+                n = min(IMPORT_BATCH, remaining)
+                block = array("f")
+                block.frombytes(vectors.read(n * dim * 4))
+                rows = [next(records) for _ in range(n)]
+                coll.upsert(
+                    ids=[r["id"] for r in rows],
+                    documents=[r["document"] for r in rows],
+                    metadatas=[r["metadata"] for r in rows],
+                    embeddings=[block[i * dim:(i + 1) * dim].tolist() for i in range(n)],
+                )
+                remaining -= n
+                loaded += n
+
+        if with_state:
+            for fn in STATE_FILES:
+                arc = f"state/{fn}"
+                if arc in manifest["files"]:
+                    with tar.extractfile(arc) as src, open(f"{fn}.tmp", "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    os.replace(f"{fn}.tmp", fn)
+
+    count("snapshot_import", loaded)
+    print(f"[snapshot] Imported {loaded} chunks into {len(manifest['segments'])} segments")
+    return loaded
+
+
+# ----------------------------
+# Serve directly from the archive
+# ----------------------------
+class SnapshotIndex:
+    """
+    Read-only chunk index served straight from a snapshot: vectors are
+    memory-mapped from inside the tar and searched brute force with numpy
+    (squared L2, the same ranking as the Chroma collections).
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        import numpy as np
+
+        self.path = path
+        self.manifest = verify_snapshot(path) if verify else None
+        with tarfile.open(path, "r:") as tar:
+            if self.manifest is None:
+                self.manifest = read_manifest(tar)
+            check_embed_model(self.manifest)
+            data_offset = tar.getmember("vectors.f32").offset_data
+            self.documents = []
+            ts = []
+            for rec in _iter_records(tar):
+                self.documents.append(rec["document"])
+                ts.append((rec.get("metadata") or {}).get("ts", float("nan")))
+
+        shape = (self.manifest["count"], self.manifest["dim"])
+        if shape[0]:
+            self.vectors = np.memmap(path, dtype=np.float32, mode="r", offset=data_offset, shape=shape)
+        else:
+            self.vectors = np.zeros(shape, dtype=np.float32)
+        self.sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        self.ts = np.asarray(ts, dtype=np.float64)
+
+    def query(self, query_embeddings: list, n_results: int,
+              since: t.Optional[datetime] = None, until: t.Optional[datetime] = None) -> t.List[t.List[str]]:
+        import numpy as np
+
+        if not len(self.documents):
+            return [[] for _ in query_embeddings]
+        q = np.asarray(query_embeddings, dtype=np.float32)
+        dist = self.sq_norms[None, :] - 2.0 * (q @ self.vectors.T)
+
+        since, until = chunk_store.to_local(since), chunk_store.to_local(until)
+        if since is not None or until is not None:
+            # NaN timestamps (undated chunks) fail both comparisons and drop out
+            mask = np.ones(len(self.ts), dtype=bool)
+            if since is not None:
+                mask &= self.ts >= since.timestamp()
+            if until is not None:
+                mask &= self.ts <= until.timestamp()
+            dist = np.where(mask[None, :], dist, np.inf)
+
+        k = min(n_results, dist.shape[1])
+        results = []
+        for row in dist:
+            top = np.argpartition(row, k - 1)[:k]
+            top = top[np.argsort(row[top])]
+            results.append([self.documents[i] for i in top if np.isfinite(row[i])])
+        return results
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Export/import page chunk index snapshots.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_exp = sub.add_parser("export", help="write the chunk index to a snapshot archive")
+    p_exp.add_argument("path")
+    p_imp = sub.add_parser("import", help="bulk-load a snapshot archive into the chunk index")
+    p_imp.add_argument("path")
+    p_imp.add_argument("--with-state", action="store_true",
+                       help="also restore seen_urls.json / last_fetched.json")
+    p_ver = sub.add_parser("verify", help="check a snapshot's version and checksums")
+    p_ver.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "verify":
+        manifest = verify_snapshot(args.path)
+        print(f"[snapshot] OK: {manifest['count']} chunks, {manifest['dim']} dims, created {manifest['created_at']}")
+        return
+
+    import chromadb
+    client = chromadb.PersistentClient(path=chunk_store.CHUNKS_DB_PATH)
+    if args.command == "export":
+        export_snapshot(client, args.path, embed_model=chunk_store.EMBED_MODEL)
+    else:
+        import_snapshot(client, args.path, with_state=args.with_state)
+
+
+if __name__ == "__main__":
+    main()